@@ -1,18 +1,72 @@
 # app.py
 
+import time
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-from io import StringIO
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
 
 # Import the helper functions from your other file
 from main_stowage_viewer import (
     REQUIRED_COLUMNS,
-    row_to_y,
-    calculate_dimensions,
-    create_container_traces
+    coerce_locations,
+    container_columns,
+    validate_colours,
+    create_figure,
+    read_containers
 )
 
+# Plans with more containers than this are meshed on a worker thread.
+BACKGROUND_BUILD_ROWS = 10_000
+
+# --- Cached computation ---
+# Keyed on the raw CSV bytes so widget reruns skip re-parsing and re-meshing.
+@st.cache_data(max_entries=16)
+def load_df(csv_bytes: bytes) -> pd.DataFrame:
+    """Parses the uploaded or pasted CSV."""
+    return read_containers(BytesIO(csv_bytes))
+
+def validate_df(df: pd.DataFrame) -> str | None:
+    """Returns an error message if the parsed CSV can't be plotted, otherwise None."""
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        return f"Error: CSV must contain the columns: {REQUIRED_COLUMNS} (missing: {missing})"
+    if df.empty:
+        return "Error: CSV contains a header but no container rows."
+    return None
+
+@st.cache_data(max_entries=16, show_spinner="Building mesh...")
+def build_figure(df: pd.DataFrame) -> go.Figure:
+    """Builds the 3D figure for a cleaned container DataFrame."""
+    return create_figure(container_columns(df))
+
+@st.cache_resource
+def build_executor() -> ThreadPoolExecutor:
+    """Shared worker pool for background figure builds."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="stowage-build")
+
+# Finished futures hold whole figures outside build_figure's cache, so keep few
+# and let them expire.
+@st.cache_resource(max_entries=4, ttl="10m")
+def submit_build(df: pd.DataFrame) -> Future:
+    """Starts building the figure in the background; reruns reattach to the same future."""
+    return build_executor().submit(lambda: create_figure(container_columns(df)))
+
+def wait_for_figure(df: pd.DataFrame) -> go.Figure:
+    """Polls a background build, updating a placeholder so widget reruns can interrupt the wait."""
+    future = submit_build(df)
+    status = st.empty()
+    start = time.monotonic()
+    while not future.done():
+        status.info(f"Building mesh for {len(df)} containers... {time.monotonic() - start:.0f}s")
+        time.sleep(0.25)
+    status.empty()
+    if future.exception() is not None:
+        # Don't keep a failed build around; the next rerun retries it.
+        submit_build.clear(df)
+    return future.result()
+
 # --- Page Configuration ---
 st.set_page_config(layout="wide", page_title="Stowage Viewer")
 st.title("🚢 3D Stowage Plan Visualizer")
@@ -32,75 +86,41 @@ with col1:
     )
 
     # Determine the data source
-    data_source = uploaded_file if uploaded_file else pasted_data
+    csv_bytes = uploaded_file.getvalue() if uploaded_file else pasted_data.encode()
 
 with col2:
     st.header("3D Visualization")
 
-    if data_source:
+    if csv_bytes:
+        # Read the data into a pandas DataFrame; only parsing is expected to fail
         try:
-            # Read the data into a pandas DataFrame
-            if isinstance(data_source, str):
-                df = pd.read_csv(StringIO(data_source))
-            else:  # It's an uploaded file
-                df = pd.read_csv(data_source)
+            df = load_df(csv_bytes)
+            error = validate_df(df)
+        except ValueError as e:
+            error = f"Could not read the CSV data: {e}"
 
+        if error:
+            st.error(error)
+        else:
             # --- This is the core logic from your main_stowage_viewer.py ---
-            if not all(col in df.columns for col in REQUIRED_COLUMNS):
-                st.error(f"Error: CSV must contain the columns: {REQUIRED_COLUMNS}")
+            df = df.dropna(subset=["Bay", "Row", "Tier"])
+            df, skipped = coerce_locations(df)
+            if not skipped.empty:
+                st.warning(f"Skipped {len(skipped)} container(s) with an invalid Bay/Row/Tier.")
+            df, bad_colours = validate_colours(df)
+            if not bad_colours.empty:
+                values = ", ".join(sorted(bad_colours["Colour"].fillna("<blank>").astype(str).unique()))
+                st.warning(f"Skipped {len(bad_colours)} container(s) with an invalid Colour: {values}")
+
+            if df.empty:
+                st.info("No containers with a valid Bay/Row/Tier and Colour to display.")
             else:
-                df.dropna(subset=["Bay", "Row", "Tier"], inplace=True)
-                fig = go.Figure()
-
-                for _, c in df.iterrows():
-                    bay = int(c["Bay"])
-                    y = row_to_y(c["Row"])
-                    z = int(c["Tier"]) - 1
-                    x_start, length = calculate_dimensions(bay)
-                    hover_text = (
-                        f"<b>ID:</b> {c['Container_ID']}<br>"
-                        f"<b>Location:</b> {c['Container_Location']}<br>"
-                        f"<b>Cargo:</b> {c['Declared_Cargo']}"
-                    )
-                    traces = create_container_traces(
-                        x=x_start, y=y, z=z,
-                        length=length, width=1.0, height=1.0,
-                        color=c["Colour"],
-                        hovertext=hover_text
-                    )
-                    for trace in traces:
-                        fig.add_trace(trace)
-                
-                # Prepare custom axis ticks
-                even_bays = sorted([b for b in df['Bay'].unique() if b % 2 == 0])
-                bay_tickvals = [(b - 2) / 2 for b in even_bays]
-                # --- MODIFIED LINE ---
-                bay_ticktext = [f"{int(b):02d}" for b in even_bays] # Convert to int before formatting
-
-                unique_tiers = sorted(df['Tier'].unique())
-                tier_tickvals = [t - 1 for t in unique_tiers]
-                tier_ticktext = [str(t) for t in unique_tiers]
-                unique_rows = sorted(df['Row'].unique())
-                row_tickvals = [row_to_y(r) for r in unique_rows]
-                row_ticktext = [str(r) for r in unique_rows]
-
-                fig.update_layout(
-                    title='Vessel Stowage Plan',
-                    showlegend=False,
-                    scene=dict(
-                        xaxis=dict(title="Bay", tickvals=bay_tickvals, ticktext=bay_ticktext),
-                        yaxis=dict(title="Row", tickvals=row_tickvals, ticktext=row_ticktext),
-                        zaxis=dict(title="Tier", tickvals=tier_tickvals, ticktext=tier_ticktext),
-                        aspectmode="data",
-                        camera=dict(eye=dict(x=1.8, y=-1.8, z=1.5))
-                    ),
-                    margin=dict(l=0, r=0, b=0, t=40)
-                )
+                if len(df) > BACKGROUND_BUILD_ROWS:
+                    fig = wait_for_figure(df)
+                else:
+                    fig = build_figure(df)
 
                 # Display the final plot
                 st.plotly_chart(fig, use_container_width=True)
-
-        except Exception as e:
-            st.error(f"An error occurred while processing the data: {e}")
     else:
         st.info("Upload or paste data to see the visualization.")
@@ -1,13 +1,61 @@
 # main_stowage_viewer.py
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.offline as pyo
+import plotly.io as pio
 import sys
 
+# Plotly's colour validator lives in a private package; is_plotly_colour falls
+# back to building a trace if it moves.
+try:
+    from _plotly_utils.basevalidators import ColorValidator
+except ImportError:
+    ColorValidator = None
+
 # ---------- constants ----------
 REQUIRED_COLUMNS = ["Bay", "Row", "Tier", "Container_ID", "Container_Location", "Declared_Cargo", "Colour"]
 
+# Explicit dtypes for the text columns skip pandas' type inference. Bay/Row/Tier
+# are left to coerce_locations so one malformed value only skips that container.
+CSV_DTYPES = {
+    "Container_ID": "string",
+    "Container_Location": "string",
+    "Declared_Cargo": "string",
+    "Colour": "string",
+}
+
+# Scene units per container unit. Bays start on half-unit positions, so doubling
+# makes every corner an integer that can be shipped as int16.
+COORD_SCALE = 2
+
+# Largest |Bay|, |Row| or |Tier| whose scaled corners (at most COORD_SCALE * (value + 2))
+# still fit in int16.
+MAX_LOCATION = np.iinfo(np.int16).max // COORD_SCALE - 2
+
+# Above this many containers the wireframe is dropped and the mesh is lit more
+# directionally instead, so neighbouring faces stay distinguishable.
+WIREFRAME_MAX_CONTAINERS = 500
+
+# Unit-cube corners (x, y, z); x is scaled by the container length.
+_CUBE_V = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                    [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]], dtype=np.float32)
+
+# The 12 triangles of a cube as _CUBE_V corner indices.
+_FACE_I = np.array([0, 0, 4, 4, 0, 0, 1, 1, 2, 2, 3, 3], dtype=np.int32)
+_FACE_J = np.array([1, 3, 5, 7, 4, 7, 2, 6, 3, 7, 4, 5], dtype=np.int32)
+_FACE_K = np.array([2, 2, 6, 6, 7, 3, 6, 5, 7, 6, 5, 1], dtype=np.int32)
+
+# The 12 cube edges as corner index pairs.
+_EDGE_PAIRS = np.array([[0, 1], [1, 2], [2, 3], [3, 0], [4, 5], [5, 6],
+                        [6, 7], [7, 4], [0, 4], [1, 5], [2, 6], [3, 7]], dtype=np.int32)
+
+# The same edges as one pen path: bottom loop, up one pillar, top loop, then the
+# 3 remaining pillars. -1 lifts the pen (plotted as a gap), so each cube costs
+# 20 points instead of one point pair per edge.
+_EDGE_PATH = np.array([0, 1, 2, 3, 0, 4, 5, 6, 7, 4, -1, 1, 5, -1, 2, 6, -1, 3, 7, -1], dtype=np.int32)
+_EDGE_GAPS = _EDGE_PATH < 0
+
 # ---------- helpers ----------
 def row_to_y(row):
     """Converts ship row numbering to Cartesian Y-coordinates."""
@@ -30,57 +78,213 @@ def calculate_dimensions(bay):
         length = 1.0
     return x_start, length
 
-def create_container_traces(x, y, z, length, width, height, color, hovertext):
-    """Creates traces for a container's solid faces and wireframe edges."""
-    vertices = {
-        'x': [x, x + length, x + length, x, x, x + length, x + length, x],
-        'y': [y, y, y + width, y + width, y, y, y + width, y + width],
-        'z': [z, z, z, z, z + height, z + height, z + height, z + height]
+def rows_to_y(rows):
+    """Vectorized row_to_y for an integer array of ship rows."""
+    return np.where(rows == 0, 0, np.where(rows % 2 == 1, 1, -1) * ((rows + 1) // 2))
+
+def read_containers(source):
+    """Reads only the required columns of a stowage CSV from a path or file-like object."""
+    return pd.read_csv(source, usecols=lambda col: col in REQUIRED_COLUMNS, dtype=CSV_DTYPES, engine="c")
+
+def coerce_locations(df):
+    """Coerces Bay/Row/Tier to integers, returning the valid rows and the rows that could not be parsed."""
+    coords = df[["Bay", "Row", "Tier"]].apply(pd.to_numeric, errors="coerce")
+    # Larger values would wrap silently in the int16 casts here and in cube_vertices.
+    invalid = (coords.isna() | (coords.abs() > MAX_LOCATION)).any(axis=1).to_numpy()
+    valid = df.loc[~invalid].copy()
+    valid[["Bay", "Row", "Tier"]] = coords.loc[~invalid].astype(np.int16)
+    return valid, df.loc[invalid]
+
+def is_plotly_colour(value):
+    """Returns True if plotly accepts value as a trace colour."""
+    if ColorValidator is not None:
+        try:
+            return ColorValidator.perform_validate_coerce(value) is not None
+        except AttributeError:
+            pass
+    try:
+        go.Mesh3d(color=value)
+    except ValueError:
+        return False
+    return True
+
+def valid_colours(colours):
+    """Vectorized colour check: True where plotly accepts the value as a colour, False for invalid or missing ones."""
+    codes, uniques = pd.factorize(pd.Series(colours, dtype=object))
+    accepted = np.array([is_plotly_colour(c) for c in uniques], dtype=bool)
+    # factorize marks missing values with -1, which picks the trailing False.
+    return np.append(accepted, False)[codes]
+
+def validate_colours(df):
+    """Splits off containers whose Colour plotly can't draw, returning the valid rows and the rejected ones."""
+    ok = valid_colours(df["Colour"])
+    return df.loc[ok], df.loc[~ok]
+
+def container_geometry(bay, row, tier):
+    """Vectorized row_to_y/calculate_dimensions: returns x_start, y, z and length arrays for every container."""
+    y = rows_to_y(row)
+    even = bay % 2 == 0
+    x_start = np.where(even, (bay - 2) / 2, (bay - 1) / 2)
+    length = np.where(even, 2.0, 1.0)
+    z = tier - 1
+    return x_start, y, z, length
+
+def hover_texts(df):
+    """Builds the hover label for every container in one vectorized string operation."""
+    # A single missing field would otherwise turn the whole concatenated label into NA.
+    fields = df[["Container_ID", "Container_Location", "Declared_Cargo"]].fillna("").astype(str)
+    return (
+        "<b>ID:</b> " + fields["Container_ID"]
+        + "<br><b>Location:</b> " + fields["Container_Location"]
+        + "<br><b>Cargo:</b> " + fields["Declared_Cargo"]
+    ).to_numpy(dtype=object)
+
+def container_columns(df):
+    """Materializes everything create_figure needs as NumPy arrays, so the DataFrame can be dropped."""
+    return {
+        "bays": df["Bay"].to_numpy(dtype=np.int32),
+        "rows": df["Row"].to_numpy(dtype=np.int32),
+        "tiers": df["Tier"].to_numpy(dtype=np.int32),
+        "colors": df["Colour"].to_numpy(dtype=object),
+        "hovertexts": hover_texts(df),
     }
 
-    face_mesh = go.Mesh3d(
-        x=vertices['x'], y=vertices['y'], z=vertices['z'],
-        i = [0, 0, 4, 4, 0, 0, 1, 1, 2, 2, 3, 3],
-        j = [1, 3, 5, 7, 4, 7, 2, 6, 3, 7, 4, 5],
-        k = [2, 2, 6, 6, 7, 3, 6, 5, 7, 6, 5, 1],
-        color=color,
+def cube_vertices(x_start, y, z, length):
+    """Returns (N, 8) int16 x/y/z corner arrays, in COORD_SCALE scene units, for every container."""
+    x_start, y, z, length = (np.asarray(a, dtype=np.float32) for a in (x_start, y, z, length))
+    vx = x_start[:, None] + _CUBE_V[:, 0][None, :] * length[:, None]
+    vy = y[:, None] + _CUBE_V[:, 1][None, :]
+    vz = z[:, None] + _CUBE_V[:, 2][None, :]
+    scaled = tuple(np.rint(COORD_SCALE * v) for v in (vx, vy, vz))
+    limits = np.iinfo(np.int16)
+    if any(v.size and (v.min() < limits.min or v.max() > limits.max) for v in scaled):
+        raise ValueError(f"Container coordinates exceed the int16 scene range; keep Bay/Row/Tier within {MAX_LOCATION}.")
+    return tuple(v.astype(np.int16) for v in scaled)
+
+def build_batched_mesh(vx, vy, vz, colors, hovertexts, shaded=False):
+    """Creates a single Mesh3d holding the solid faces of every container."""
+    n = len(vx)
+
+    # Each container owns 8 consecutive vertices, so its 12 triangles are the
+    # single-cube face template shifted by 8 * container index.
+    offsets = 8 * np.arange(n, dtype=np.int32)[:, None]
+    i = (_FACE_I + offsets).ravel()
+    j = (_FACE_J + offsets).ravel()
+    k = (_FACE_K + offsets).ravel()
+
+    # Colour faces through a per-cell palette index rather than a facecolor
+    # string per triangle: the 12N colour strings become a uint8/uint16 array
+    # plus a stepped colorscale holding each distinct colour once.
+    palette, codes = np.unique(np.asarray(colors, dtype=object), return_inverse=True)
+    steps = np.linspace(0, 1, len(palette) + 1)
+    colorscale = [[float(s), c] for lo, hi, c in zip(steps[:-1], steps[1:], palette) for s in (lo, hi)]
+    code_dtype = np.uint8 if len(palette) <= 256 else np.uint16
+
+    return go.Mesh3d(
+        x=vx.ravel().astype(np.int16, copy=False),
+        y=vy.ravel().astype(np.int16, copy=False),
+        z=vz.ravel().astype(np.int16, copy=False),
+        i=i, j=j, k=k,
+        intensity=np.repeat(codes.astype(code_dtype), 12),
+        intensitymode="cell",
+        colorscale=colorscale,
+        cmin=-0.5,
+        cmax=len(palette) - 0.5,
+        showscale=False,
         opacity=1.0,
         hoverinfo="text",
-        text=hovertext,
+        # Mesh3d hover text is per vertex, not per face.
+        text=np.repeat(np.asarray(hovertexts, dtype=object), 8),
         flatshading=True,
+        # Without a wireframe (shaded), stronger diffuse light separates the faces.
         lighting=dict(
-            ambient=0.8,
-            diffuse=0.2,
-            specular=0.0
+            ambient=0.5 if shaded else 0.8,
+            diffuse=0.5 if shaded else 0.2,
+            specular=0.1 if shaded else 0.0,
+            facenormalsepsilon=0
         )
     )
 
-    path_indices = [0,1,2,3,0, None, 4,5,6,7,4, None, 0,4, None, 1,5, None, 2,6, None, 3,7]
-    edge_x, edge_y, edge_z = [], [], []
-    for i in path_indices:
-        if i is None:
-            edge_x.append(None)
-            edge_y.append(None)
-            edge_z.append(None)
-        else:
-            edge_x.append(vertices['x'][i])
-            edge_y.append(vertices['y'][i])
-            edge_z.append(vertices['z'][i])
-
-    edge_wireframe = go.Scatter3d(
+def build_wireframe(vx, vy, vz):
+    """Creates a single Scatter3d drawing the edges of every container, with gaps between cubes."""
+    # Neighbouring containers share edges, so draw each distinct edge once as a
+    # point pair plus a NaN gap. Corners are integer scene units, so they are
+    # exact keys for np.unique.
+    corners = np.stack([vx, vy, vz], axis=-1)
+    ends = corners[:, _EDGE_PAIRS].astype(np.int32).reshape(-1, 2, 3)
+    # Edges are axis-aligned, so ordering the endpoints by coordinate sum makes
+    # the same edge produce the same key from either cube.
+    flip = ends[:, 0].sum(axis=1) > ends[:, 1].sum(axis=1)
+    ends[flip] = ends[flip, ::-1]
+    unique_ends = np.unique(ends.reshape(-1, 6), axis=0).reshape(-1, 2, 3)
+
+    if 3 * len(unique_ends) < len(_EDGE_PATH) * len(vx):
+        segments = np.full((len(unique_ends), 3, 3), np.nan, dtype=np.float32)
+        segments[:, :2] = unique_ends
+        edge_x, edge_y, edge_z = segments.reshape(-1, 3).T
+    else:
+        # Sparse plans share few edges; the per-cube pen path is then shorter.
+        path = corners[:, np.where(_EDGE_GAPS, 0, _EDGE_PATH)].astype(np.float32)
+        path[:, _EDGE_GAPS] = np.nan
+        edge_x, edge_y, edge_z = path.reshape(-1, 3).T
+
+    return go.Scatter3d(
         x=edge_x, y=edge_y, z=edge_z,
         mode='lines',
         line=dict(color='black', width=2),
         hoverinfo='none'
     )
-    
-    return [face_mesh, edge_wireframe]
+
+def axis_range(v):
+    """Returns fixed axis settings covering v, so plotly.js skips its own bounds pass."""
+    if v.size == 0:
+        return dict(autorange=True)
+    return dict(autorange=False, range=[float(v.min()), float(v.max())])
+
+def create_figure(columns):
+    """Builds the stowage figure from container_columns arrays; colours must already have passed validate_colours."""
+    bays, rows, tiers = columns["bays"], columns["rows"], columns["tiers"]
+    vx, vy, vz = cube_vertices(*container_geometry(bays, rows, tiers))
+    draw_edges = len(bays) <= WIREFRAME_MAX_CONTAINERS
+    traces = []
+    if len(bays):
+        traces.append(build_batched_mesh(vx, vy, vz, columns["colors"], columns["hovertexts"], shaded=not draw_edges))
+        if draw_edges:
+            traces.append(build_wireframe(vx, vy, vz))
+
+    # --- NEW: Prepare Custom Axis Ticks ---
+    bays_u = np.unique(bays)
+    even_bays = bays_u[bays_u % 2 == 0]
+    bay_tickvals = (COORD_SCALE * (even_bays - 2) // 2).tolist()
+    bay_ticktext = np.char.mod('%02d', even_bays).tolist()
+
+    tiers_u = np.unique(tiers)
+    tier_tickvals = (COORD_SCALE * (tiers_u - 1)).tolist()
+    tier_ticktext = np.char.mod('%d', tiers_u).tolist()
+
+    rows_u = np.unique(rows)
+    row_tickvals = (COORD_SCALE * rows_to_y(rows_u)).tolist()
+    row_ticktext = np.char.mod('%d', rows_u).tolist()
+
+    layout = go.Layout(
+        title='Vessel Stowage Plan',
+        showlegend=False,
+        scene=dict(
+            xaxis=dict(title="Bay", tickvals=bay_tickvals, ticktext=bay_ticktext, **axis_range(vx)),
+            yaxis=dict(title="Row", tickvals=row_tickvals, ticktext=row_ticktext, **axis_range(vy)),
+            zaxis=dict(title="Tier", tickvals=tier_tickvals, ticktext=tier_ticktext, **axis_range(vz)),
+            aspectmode="data",
+            camera=dict(eye=dict(x=1.8, y=-1.8, z=1.5))
+        ),
+        margin=dict(l=0, r=0, b=0, t=40)
+    )
+    return go.Figure(data=traces, layout=layout)
 
 
 def main(csv_path, output_path):
     """Main function to load data, create the plot, and save it."""
     try:
-        df = pd.read_csv(csv_path)
+        df = read_containers(csv_path)
     except FileNotFoundError:
         print(f"Error: The file '{csv_path}' was not found.")
         sys.exit(1)
@@ -90,63 +294,22 @@ def main(csv_path, output_path):
         sys.exit(1)
 
     df.dropna(subset=["Bay", "Row", "Tier"], inplace=True)
+    df, skipped = coerce_locations(df)
+    for cid, bay, row, tier in skipped[["Container_ID", "Bay", "Row", "Tier"]].fillna("<blank>").itertuples(index=False, name=None):
+        print(f"Warning: Skipping container {cid} due to invalid location: Bay={bay}, Row={row}, Tier={tier}")
+    df, bad_colours = validate_colours(df)
+    for cid, colour in bad_colours[["Container_ID", "Colour"]].fillna("<blank>").itertuples(index=False, name=None):
+        print(f"Warning: Skipping container {cid} due to invalid 'Colour' value: {colour}")
 
-    fig = go.Figure()
     print(f"Processing {len(df)} containers...")
+    columns = container_columns(df)
+    # Free the DataFrame before the vertex arrays are allocated.
+    del df, skipped, bad_colours
+    fig = create_figure(columns)
 
-    for _, c in df.iterrows():
-        try:
-            bay = int(c["Bay"])
-            y = row_to_y(c["Row"])
-            z = int(c["Tier"]) - 1
-            if y is None:
-                print(f"Warning: Skipping container {c['Container_ID']} due to invalid 'Row' value: {c['Row']}")
-                continue
-            x_start, length = calculate_dimensions(bay)
-            hover_text = (
-                f"<b>ID:</b> {c['Container_ID']}<br>"
-                f"<b>Location:</b> {c['Container_Location']}<br>"
-                f"<b>Cargo:</b> {c['Declared_Cargo']}"
-            )
-            
-            container_traces = create_container_traces(
-                x=x_start, y=y, z=z,
-                length=length, width=1.0, height=1.0,
-                color=c["Colour"],
-                hovertext=hover_text
-            )
-            for trace in container_traces:
-                fig.add_trace(trace)
-
-        except (ValueError, TypeError) as e:
-            print(f"Warning: Skipping container {c['Container_ID']} due to a data error: {e}")
-            continue
-
-    # --- NEW: Prepare Custom Axis Ticks ---
-    even_bays = sorted([b for b in df['Bay'].unique() if b % 2 == 0])
-    bay_tickvals = [(b - 2) / 2 for b in even_bays]
-    bay_ticktext = [f"{b:02d}" for b in even_bays]
-
-    unique_tiers = sorted(df['Tier'].unique())
-    tier_tickvals = [t - 1 for t in unique_tiers]
-    tier_ticktext = [str(t) for t in unique_tiers]
+    if output_path:
+        pio.write_html(fig, output_path, include_plotlyjs="cdn", full_html=True, auto_open=False)
+        print(f"Saved stowage plan to '{output_path}'.")
 
-    unique_rows = sorted(df['Row'].unique())
-    row_tickvals = [row_to_y(r) for r in unique_rows]
-    row_ticktext = [str(r) for r in unique_rows]
-
-    fig.update_layout(
-        title='Vessel Stowage Plan',
-        showlegend=False,
-        scene=dict(
-            xaxis=dict(title="Bay", tickvals=bay_tickvals, ticktext=bay_ticktext),
-            yaxis=dict(title="Row", tickvals=row_tickvals, ticktext=row_ticktext),
-            zaxis=dict(title="Tier", tickvals=tier_tickvals, ticktext=tier_ticktext),
-            aspectmode="data",
-            camera=dict(eye=dict(x=1.8, y=-1.8, z=1.5))
-        ),
-        margin=dict(l=0, r=0, b=0, t=40)
-    )
-    
     # This function will now return the figure to the main app
     return fig